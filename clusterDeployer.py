@@ -14,6 +14,7 @@ from typing import List
 from typing import Callable
 import re
 import socket
+import ipaddress
 import logging
 import paramiko
 from assistedInstaller import AssistedClientAutomation
@@ -93,31 +94,33 @@ def setup_vm(h: host.Host, cfg: NodeConfig, iso_or_image_path: str) -> host.Resu
         logger.info(f"creating {disk_size_gb}GB storage for VM {name} at {cfg.image_path}")
         h.run_or_die(f'qemu-img create -f qcow2 {options} {cfg.image_path} {disk_size_gb}G')
 
-        cdrom_line = f"--cdrom {iso_or_image_path}"
+        cdrom_line = [f"--cdrom {iso_or_image_path}"]
         append = "--wait=-1"
     else:
-        cdrom_line = ""
+        cdrom_line = []
         append = "--noautoconsole"
 
     if h.is_localhost():
         network = "network=default"
     else:
         network = "bridge=virbr0"
-    cmd = f"""
-    virt-install
-        --connect qemu:///system
-        -n {name}
-        -r {cfg.ram}
-        --cpu host
-        --vcpus {cfg.cpu}
-        --os-variant={cfg.os_variant}
-        --import
-        --network {network},mac={mac}
-        --events on_reboot=restart
-        {cdrom_line}
-        --disk path={cfg.image_path}
-        {append}
-    """
+    cmd = " ".join(
+        [
+            "virt-install",
+            "--connect qemu:///system",
+            f"-n {name}",
+            f"-r {cfg.ram}",
+            "--cpu host",
+            f"--vcpus {cfg.cpu}",
+            f"--os-variant={cfg.os_variant}",
+            "--import",
+            f"--network {network},mac={mac}",
+            "--events on_reboot=restart",
+            *cdrom_line,
+            f"--disk path={cfg.image_path}",
+            append,
+        ]
+    )
 
     logger.info(f"Starting VM {name}")
     ret = h.run(cmd)
@@ -851,12 +854,15 @@ class ClusterDeployer:
                     ret.append(k["local"])
             return ret
 
+        # Parse the subnet once instead of once per address of every worker.
+        network = ipaddress.ip_network(subnet)
+
         def addr_ok(a: str) -> bool:
-            return common.ip_in_subnet(a, subnet)
+            return ipaddress.ip_address(a) in network
 
         any_worker_bad = False
         for w, h in zip(self._cc.workers, hosts):
-            if all(not addr_ok(a) for a in addresses(h)):
+            if not any(addr_ok(a) for a in addresses(h)):
                 logger.info(f"Worker {w.name} doesn't have an IP in {subnet}.")
                 any_worker_bad = True
 
@@ -1030,11 +1036,11 @@ class ClusterDeployer:
         # ip is printed as the last thing when bf is pxeboot'ed
         bf_ip = output.out.strip().split("\n")[-1].strip()
         h.connect_to_bf(bf_ip)
-        tries = 3
+        timeout = 20
         bf_interfaces = ["enp3s0f0", "enp3s0f0np0"]
-        logger.info(f'Will try {tries} times to get an IP on {" or ".join(bf_interfaces)}')
-        ip = None
-        for _ in range(tries):
+        logger.info(f'Will try for {timeout}s to get an IP on {" or ".join(bf_interfaces)}')
+
+        def bf_ip_addr() -> Optional[str]:
             ipa = h.run_on_bf("ip -json a").out
             detected = common.ipa_to_entries(ipa)
             found = [e for e in detected if e.ifname in bf_interfaces]
@@ -1049,10 +1055,9 @@ class ClusterDeployer:
                     ip = e.local
             if ip is None:
                 logger.info(f"IP missing on {found[0]}, output was {ipa}")
-            else:
-                break
-            time.sleep(10)
+            return ip
 
+        ip = common.poll_until(bf_ip_addr, total_timeout=timeout)
         if ip is None:
             sys.exit(-1)
         logger.info(f"Detected ip {ip}")
@@ -17,8 +17,13 @@ from clusterInfo import load_all_cluster_info
 from dataclasses import dataclass
 
 
+_OCTET_RE = re.compile("..")
+_LAB_NUMBER_RE = re.compile(r"lab(\d+)")
+_NON_DIGIT_RE = re.compile("[^0-9]")
+
+
 def random_mac() -> str:
-    return "52:54:" + ":".join(re.findall("..", secrets.token_hex()[:8]))
+    return "52:54:" + ":".join(_OCTET_RE.findall(secrets.token_hex()[:8]))
 
 
 @dataclass
@@ -117,13 +122,13 @@ class ClustersConfig:
     kind: str = "openshift"
     version: str = "4.14.0-nightly"
     network_api_port: str = "auto"
-    masters: List[NodeConfig] = []
-    workers: List[NodeConfig] = []
-    hosts: List[HostConfig] = []
+    masters: List[NodeConfig]
+    workers: List[NodeConfig]
+    hosts: List[HostConfig]
     proxy: Optional[str] = None
     noproxy: Optional[str] = None
-    preconfig: List[ExtraConfigArgs] = []
-    postconfig: List[ExtraConfigArgs] = []
+    preconfig: List[ExtraConfigArgs]
+    postconfig: List[ExtraConfigArgs]
     ntp_source: str = "clock.redhat.com"
     base_dns_domain: str = "redhat.com"
 
@@ -133,6 +138,13 @@ class ClustersConfig:
 
     def __init__(self, yaml_path: str, worker_range: common.RangeList):
         self._cluster_info: Optional[ClusterInfo] = None
+        # Per-instance lists; class-level defaults would be shared (and
+        # appended to) by every ClustersConfig created in the process.
+        self.masters = []
+        self.workers = []
+        self.hosts = []
+        self.preconfig = []
+        self.postconfig = []
         self._load_full_config(yaml_path)
         self._check_deprecated_config()
 
@@ -245,11 +257,11 @@ class ClustersConfig:
             self._ensure_clusters_loaded()
             assert self._cluster_info is not None
             name = self._cluster_info.workers[a]
-            lab_match = re.search("lab(\d+)", name)
+            lab_match = _LAB_NUMBER_RE.search(name)
             if lab_match:
                 return lab_match.group(1)
             else:
-                return re.sub("[^0-9]", "", name)
+                return _NON_DIGIT_RE.sub("", name)
 
         def worker_name(a: int) -> str:
             self._ensure_clusters_loaded()
@@ -1,11 +1,14 @@
 from dataclasses import dataclass
+import functools
 import ipaddress
 from threading import local
-from typing import List, Optional, Set, Tuple, TypeVar, Iterator
+from typing import Callable, List, Optional, Set, Tuple, TypeVar, Union
 import host
 import json
 import os
 import glob
+import time
+import jinja2
 
 
 T = TypeVar("T")
@@ -26,10 +29,11 @@ def str_to_list(input_str: str) -> List[int]:
 
 
 class RangeList:
-    _range: List[Tuple[bool, List[int]]] = []
+    _range: List[Tuple[bool, List[int]]]
     initial_values: Optional[List[int]] = None
 
     def __init__(self, initial_values: Optional[List[int]] = None):
+        self._range = []
         self.initial_values = initial_values
 
     def _append(self, l: List[int], expand: bool) -> None:
@@ -46,21 +50,23 @@ class RangeList:
         if self.initial_values is not None:
             applied &= set(self.initial_values)
 
+        # Update in place, each step would otherwise build a temporary set
+        # from l and then another one for the result.
         for expand, l in self._range:
             if expand:
-                applied = applied | set(l)
+                applied.update(l)
             else:
-                applied = applied - set(l)
+                applied.difference_update(l)
         return [initial[x] for x in sorted(applied) if x < len(initial)]
 
 
-@dataclass
+@dataclass(slots=True)
 class IPRouteAddressInfoEntry:
     family: str
     local: str
 
 
-@dataclass
+@dataclass(slots=True)
 class IPRouteAddressEntry:
     ifindex: int
     ifname: str
@@ -91,7 +97,7 @@ def ipr(host: host.Host) -> str:
     return host.run("ip -json r").out
 
 
-@dataclass
+@dataclass(slots=True)
 class IPRouteRouteEntry:
     dst: str
     dev: str
@@ -105,8 +111,15 @@ def ipr_to_entries(input: str) -> List[IPRouteRouteEntry]:
     return ret
 
 
+@functools.lru_cache(maxsize=None)
+def _ip_network(subnet: str) -> Union[ipaddress.IPv4Network, ipaddress.IPv6Network]:
+    return ipaddress.ip_network(subnet)
+
+
 def ip_in_subnet(addr: str, subnet: str) -> bool:
-    return ipaddress.ip_address(addr) in ipaddress.ip_network(subnet)
+    # Callers check many addresses against the same few subnets, so only
+    # parse each subnet once. Membership itself is an integer compare.
+    return ipaddress.ip_address(addr) in _ip_network(subnet)
 
 
 def extract_interfaces(input: str) -> List[str]:
@@ -160,9 +173,39 @@ def get_auto_port(host: host.Host) -> str:
         return interfaces[0].ifname
 
 
-def iterate_ssh_keys() -> Iterator[Tuple[str, str, str]]:
+# The keys are read once; callers run per node and the keys don't change
+# while we run.
+@functools.lru_cache(maxsize=1)
+def iterate_ssh_keys() -> Tuple[Tuple[str, str, str], ...]:
+    keys = []
     for pub_file in glob.glob("/root/.ssh/*.pub"):
         with open(pub_file, 'r') as f:
             pub_key_content = f.read().strip()
             priv_key_file = os.path.splitext(pub_file)[0]
-            yield pub_file, pub_key_content, priv_key_file
+            keys.append((pub_file, pub_key_content, priv_key_file))
+    return tuple(keys)
+
+
+# Manifest templates don't change while we run; compile each one only once.
+@functools.lru_cache(maxsize=None)
+def jinja_template(path: str) -> jinja2.Template:
+    with open(path) as f:
+        return jinja2.Template(f.read())
+
+
+# Calls fn until it returns something other than None, and returns that. The
+# delay between attempts starts at initial and grows by factor up to cap, so
+# a condition that becomes true early is noticed early. Returns None if fn
+# still fails once total_timeout seconds have passed.
+def poll_until(fn: Callable[[], Optional[T]], total_timeout: float, initial: float = 2.0, factor: float = 1.5, cap: float = 20.0) -> Optional[T]:
+    deadline = time.monotonic() + total_timeout
+    delay = initial
+    while True:
+        ret = fn()
+        if ret is not None:
+            return ret
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(delay, remaining))
+        delay = min(delay * factor, cap)
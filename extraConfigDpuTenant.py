@@ -10,7 +10,7 @@ from typing import Dict
 from typing import List
 from typing import Union
 import sys
-import jinja2
+import common
 import json
 import os
 import re
@@ -41,19 +41,16 @@ def ExtraConfigDpuTenantMC(cc: ClustersConfig, _: ExtraConfigArgs, futures: Dict
 
 
 def render_sriov_node_policy(policyname: str, bf_port: str, bf_addr: str, numvfs: int, resourcename: str, outfilename: str) -> None:
-    with open("./manifests/tenant/SriovNetworkNodePolicy.yaml.j2") as f:
-        j2_template = jinja2.Template(f.read())
-        rendered = j2_template.render(policyName=policyname, bf_port=bf_port, bf_addr=bf_addr, numVfs=numvfs, resourceName=resourcename)
-        logger.info(rendered)
+    j2_template = common.jinja_template("./manifests/tenant/SriovNetworkNodePolicy.yaml.j2")
+    rendered = j2_template.render(policyName=policyname, bf_port=bf_port, bf_addr=bf_addr, numVfs=numvfs, resourceName=resourcename)
+    logger.info(rendered)
 
     with open(outfilename, "w") as outFile:
         outFile.write(rendered)
 
 
 def render_envoverrides_cm(client: K8sClient, mapping: List[Dict[str, str]], ns: str) -> str:
-    contents = open("manifests/tenant/envoverrides.yaml").read()
-    contents += f"{ns}\n"
-    contents += "data:\n"
+    parts = [open("manifests/tenant/envoverrides.yaml").read(), f"{ns}\n", "data:\n"]
     for e in mapping:
         a: Dict[str, str] = {}
         a["TENANT_K8S_NODE"] = e["worker"]
@@ -65,11 +62,10 @@ def render_envoverrides_cm(client: K8sClient, mapping: List[Dict[str, str]], ns:
             logger.error(f"Failed to retrieve ip for {e['bf']}")
             sys.exit(1)
         a["MGMT_IFNAME"] = "c1pf0vf0"
-        contents += f"  {e['bf']}: |\n"
-        for k, v in a.items():
-            contents += f"    {k}={v}\n"
+        parts.append(f"  {e['bf']}: |\n")
+        parts.extend(f"    {k}={v}\n" for k, v in a.items())
 
-    open(f"/tmp/envoverrides-{ns}.yaml", "w").write(contents)
+    open(f"/tmp/envoverrides-{ns}.yaml", "w").write("".join(parts))
     return f"/tmp/envoverrides-{ns}.yaml"
 
 
@@ -148,16 +144,15 @@ def ExtraConfigDpuTenant(cc: ClustersConfig, cfg: ExtraConfigArgs, futures: Dict
 
     logger.info("setting ovn kube node env-override to set management port")
     logger.info(os.getcwd())
-    contents = open("manifests/tenant/setenvovnkube.yaml").read()
+    parts = [open("manifests/tenant/setenvovnkube.yaml").read()]
 
+    mp = re.sub(r'np\d$', '', bf_port)
     for bfmap in cfg.mapping:
         a: Dict[str, str] = {}
-        mp = re.sub('np\d$', '', bf_port)
         a["OVNKUBE_NODE_MGMT_PORT_NETDEV"] = f"{mp}v0"
-        contents += f"  {bfmap['worker']}: |\n"
-        for k, v in a.items():
-            contents += f"    {k}={v}\n"
-    open("/tmp/1.yaml", "w").write(contents)
+        parts.append(f"  {bfmap['worker']}: |\n")
+        parts.extend(f"    {k}={v}\n" for k, v in a.items())
+    open("/tmp/1.yaml", "w").write("".join(parts))
 
     logger.info("Running create")
     logger.info(tclient.oc("create -f /tmp/1.yaml"))
@@ -285,10 +280,9 @@ def ExtraConfigDpuTenant_NewAPI(cc: ClustersConfig, _: ExtraConfigArgs, futures:
     # DELTA START: We don't create sriovdpuconfigmap.yaml to set dpu-host mode. https://github.com/openshift/cluster-network-operator/pull/1676
     mgmtPortResourceName = "openshift.io/" + mgmtResourceName
     logger.info(f"Creating Config Map for mgmt port resource name {mgmtPortResourceName}")
-    with open('./manifests/tenant/hardware-offload-config.yaml.j2') as f:
-        j2_template = jinja2.Template(f.read())
-        rendered = j2_template.render(mgmtPortResourceName=mgmtPortResourceName)
-        logger.info(rendered)
+    j2_template = common.jinja_template('./manifests/tenant/hardware-offload-config.yaml.j2')
+    rendered = j2_template.render(mgmtPortResourceName=mgmtPortResourceName)
+    logger.info(rendered)
 
     with open("/tmp/hardware-offload-config.yaml", "w") as outFile:
         outFile.write(rendered)
@@ -6,10 +6,11 @@ from git.repo import Repo
 import time
 from concurrent.futures import Future
 import shutil
-import jinja2
+import common
 import sys
 from typing import Dict
 from typing import List
+from typing import Optional
 from logger import logger
 from clustersConfig import ExtraConfigArgs
 
@@ -69,8 +70,7 @@ def need_pci_realloc(cc: ClustersConfig, client: K8sClient) -> bool:
 
 def enable_pci_realloc(client: K8sClient, mcp_name: str) -> None:
     logger.info("Applying pci-realloc machine config")
-    with open('./manifests/nicmode/pci-realloc.yaml.j2') as f:
-        j2_template = jinja2.Template(f.read())
+    j2_template = common.jinja_template('./manifests/nicmode/pci-realloc.yaml.j2')
     rendered = j2_template.render(MCPName=mcp_name)
     logger.info(rendered)
     with open("/tmp/pci-realloc.yaml", "w") as outFile:
@@ -86,10 +86,9 @@ def ensure_pci_realloc(cc: ClustersConfig, client: K8sClient, mcp_name: str) ->
 
 
 def render_sriov_node_policy(policyname: str, pfnames: List[str], numvfs: int, resourcename: str, outfilename: str) -> None:
-    with open('./manifests/nicmode/sriov-node-policy.yaml.j2') as f:
-        j2_template = jinja2.Template(f.read())
-        rendered = j2_template.render(policyName=policyname, pfNamesAll=pfnames, numVfs=numvfs, resourceName=resourcename)
-        logger.info(rendered)
+    j2_template = common.jinja_template('./manifests/nicmode/sriov-node-policy.yaml.j2')
+    rendered = j2_template.render(policyName=policyname, pfNamesAll=pfnames, numVfs=numvfs, resourceName=resourcename)
+    logger.info(rendered)
 
     with open(outfilename, "w") as outFile:
         outFile.write(rendered)
@@ -105,17 +104,19 @@ def try_get_ovs_pf(rh: host.Host, name: str) -> str:
     except Exception:
         logger.info(f"Cannot find PF Name on node {name} using hint")
 
-    retries = 5
-    for attempt in range(1, retries + 1):
+    def find_pf() -> Optional[str]:
         interface_list = rh.run("sudo ovs-vsctl list-ifaces br-ex").out.strip().split("\n")
         selection = [x for x in interface_list if "patch" not in x]
         if selection:
-            logger.info(f"Found PF {selection} on node {name} on attempt {attempt}")
+            logger.info(f"Found PF {selection} on node {name}")
             return selection[0]
-        time.sleep(20)
+        return None
 
-    logger.error(f"Failed to find PF name on node {name} using ovs-vsctl")
-    sys.exit(-1)
+    pf = common.poll_until(find_pf, total_timeout=100)
+    if pf is None:
+        logger.error(f"Failed to find PF name on node {name} using ovs-vsctl")
+        sys.exit(-1)
+    return pf
 
 
 def ExtraConfigSriovOvSHWOL(cc: ClustersConfig, _: ExtraConfigArgs, futures: Dict[str, Future[None]]) -> None:
@@ -227,10 +228,9 @@ def ExtraConfigSriovOvSHWOL_NewAPI(cc: ClustersConfig, _: ExtraConfigArgs, futur
 
     mgmtPortResourceName = "openshift.io/" + managementResourceName
     logger.info(f"Creating Config Map for Hardware Offload with resource name {mgmtPortResourceName}")
-    with open('./manifests/nicmode/hardware-offload-config.yaml.j2') as f:
-        j2_template = jinja2.Template(f.read())
-        rendered = j2_template.render(mgmtPortResourceName=mgmtPortResourceName)
-        logger.info(rendered)
+    j2_template = common.jinja_template('./manifests/nicmode/hardware-offload-config.yaml.j2')
+    rendered = j2_template.render(mgmtPortResourceName=mgmtPortResourceName)
+    logger.info(rendered)
 
     with open("/tmp/hardware-offload-config.yaml", "w") as outFile:
         outFile.write(rendered)
@@ -1,28 +1,49 @@
 import socket
 import subprocess
 import io
+import hashlib
+import math
 import os
 import re
+import secrets
+import select
 import time
 import json
 import shlex
 import shutil
 import sys
 import logging
-import tempfile
+import threading
+import weakref
+import functools
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
 from typing import Optional
 from typing import Union
 from typing import List
-from typing import Type
 from typing import Any
 from typing import Dict
 from typing import Tuple
-from functools import lru_cache
+from typing import Iterator
+from typing import Callable
+from typing import TypeVar
 from ailib import Redfish
 import paramiko
 from paramiko import ssh_exception, RSAKey, Ed25519Key
 from logger import logger
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+
+T = TypeVar("T")
+
+
+# "KEY=value" lines of /etc/os-release; the line is split at the first "=".
+_OS_RELEASE_RE = re.compile(r"^([^=\n]*)=(.*)$", re.MULTILINE)
+# "State: running" in "virsh dominfo" output.
+_VIRSH_RUNNING_RE = re.compile("State:.*running")
 
 
 def default_id_rsa_path() -> str:
@@ -43,36 +64,348 @@ class Result:
         return f"(returncode: {self.returncode}, error: {self.err})"
 
 
+# Per-channel receive window. paramiko's default (2 MiB) throttles commands
+# with large output, such as read_file() on big files, to one window per
+# round-trip. We drain channels continuously, so a bigger window is cheap.
+_SSH_WINDOW_SIZE = 16 * 1024 * 1024
+_SSH_RECV_SIZE = 1024 * 1024
+
+
+def ssh_run_poll_result(client: paramiko.SSHClient, cmd: str, log_prefix: str, log_level: int, combine_stderr: bool = False) -> Result:
+    _, stdout, _ = client.exec_command(cmd)
+    chan = stdout.channel
+    if combine_stderr:
+        # stderr is then delivered (and logged) as part of stdout, and the
+        # stderr half of the loop below has nothing to do.
+        chan.set_combine_stderr(True)
+    # recv() is only called once recv_ready() says data is buffered, and all
+    # waiting happens in select(). Make sure recv() itself never blocks.
+    chan.setblocking(False)
+
+    out = bytearray()
+    err = bytearray()
+    # Output that is not yet terminated by a newline, kept back for logging.
+    partial = bytearray()
+    # Checked once, splitting and decoding every line of a large output only
+    # to have logger.log() drop it is the expensive part of this loop.
+    log_enabled = logger.isEnabledFor(log_level)
+
+    def log_line(line: Union[bytes, bytearray]) -> None:
+        logger.log(log_level, f"{log_prefix}: {line.decode('utf-8', 'replace').strip()}")
+
+    while True:
+        # Drain stdout and stderr as they arrive, instead of reading stdout
+        # to EOF first (a chatty stderr could otherwise fill the channel
+        # window and stall the command).
+        while chan.recv_ready():
+            try:
+                data = chan.recv(_SSH_RECV_SIZE)
+            except socket.timeout:
+                break
+            out.extend(data)
+            if not log_enabled:
+                continue
+            first, *lines = data.split(b"\n")
+            partial.extend(first)
+            if lines:
+                log_line(partial)
+                for line in lines[:-1]:
+                    log_line(line)
+                partial = bytearray(lines[-1])
+        while not combine_stderr and chan.recv_stderr_ready():
+            try:
+                err.extend(chan.recv_stderr(_SSH_RECV_SIZE))
+            except socket.timeout:
+                break
+
+        if (chan.eof_received or chan.closed) and not chan.recv_ready() and not chan.recv_stderr_ready():
+            break
+
+        # The channel's fileno becomes readable when data for either stream
+        # arrives or on EOF, so there is no need to busy-poll.
+        select.select([chan], [], [], 1.0)
+
+    if partial:
+        log_line(partial)
+
+    exit_code = chan.recv_exit_status()
+    return Result(out.decode("utf-8"), err.decode("utf-8"), exit_code)
+
+
+# Runs commands one after the other in a single remote "bash -s", instead of
+# opening a new channel for each of them. Shell state such as the working
+# directory or exported variables carries over between commands.
+class PersistentShell:
+    def __init__(self, client: paramiko.SSHClient, log_prefix: str, sudo: bool = False):
+        transport = client.get_transport()
+        assert transport is not None
+        self._chan = transport.open_session()
+        self._chan.exec_command("sudo bash -s" if sudo else "bash -s")
+        self._log_prefix = log_prefix
+        # Printed after each command on stdout (with the exit code) and on
+        # stderr, to know where a command's output ends.
+        self._marker = f"__CDA_SHELL_{secrets.token_hex(8)}__"
+
+    def run(self, cmd: str, log_level: int = logging.DEBUG) -> Result:
+        if logger.isEnabledFor(log_level):
+            logger.log(log_level, f"{self._log_prefix}: running command {cmd} in persistent shell")
+        # stdin is the script itself, don't let the command read from it.
+        script = f"{{ {cmd}\n}} </dev/null; printf '\\n{self._marker}%s\\n' $?; printf '\\n{self._marker}\\n' >&2\n"
+        self._chan.sendall(script.encode("utf-8"))
+
+        out_marker = f"\n{self._marker}".encode()
+        err_marker = f"\n{self._marker}\n".encode()
+        out = bytearray()
+        err = bytearray()
+        # The two markers are separate writes and often arrive in different
+        # passes of the loop below, so remember where each was found.
+        out_end = -1
+        rc_end = -1
+        err_end = -1
+        while True:
+            # Only search the newly received data (plus a marker's length of
+            # overlap) for markers that were not found yet.
+            out_start = max(len(out) - len(out_marker), 0)
+            err_start = max(len(err) - len(err_marker), 0)
+            while self._chan.recv_ready():
+                out.extend(self._chan.recv(_SSH_RECV_SIZE))
+            while self._chan.recv_stderr_ready():
+                err.extend(self._chan.recv_stderr(_SSH_RECV_SIZE))
+
+            if out_end < 0:
+                out_end = out.find(out_marker, out_start)
+            if out_end >= 0 and rc_end < 0:
+                rc_end = out.find(b"\n", out_end + len(out_marker))
+            if err_end < 0:
+                err_end = err.find(err_marker, err_start)
+            if rc_end >= 0 and err_end >= 0:
+                break
+            if self._chan.eof_received or self._chan.closed:
+                raise Exception(f"Persistent shell on {self._log_prefix} exited while running {cmd}")
+            select.select([self._chan], [], [], 1.0)
+
+        rc = int(out[out_end + len(out_marker) : rc_end])
+        ret = Result(out[:out_end].decode("utf-8"), err[:err_end].decode("utf-8"), rc)
+        logger.log(log_level, ret)
+        return ret
+
+    def close(self) -> None:
+        self._chan.close()
+
+
+# Live SSH clients, shared by every Host that logs in to the same host with
+# the same user and credentials, together with the number of users of each
+# and when the last user went away. Reusing a client saves the TCP connect,
+# key exchange and authentication.
+SSHPoolKey = Tuple[str, str, str]
+_ssh_pool: Dict[SSHPoolKey, Tuple[paramiko.SSHClient, int, float]] = {}
+_ssh_pool_lock = threading.Lock()
+
+# Clients without users stay in the pool for this long, so that code that
+# creates a new Host for every step (or every retry) still reuses them.
+_SSH_IDLE_TIMEOUT = 300.0
+_ssh_reaper: Optional[threading.Thread] = None
+
+# Keepalives let idle pooled transports notice a dead peer. How long a
+# pooled client may take to prove it's alive before it is replaced.
+_SSH_KEEPALIVE_INTERVAL = 30
+_SSH_PROBE_TIMEOUT = 5.0
+# How long a login may take before the next one is tried in parallel.
+_SSH_LOGIN_STAGGER = 5.0
+
+
+def _tune_transport(client: paramiko.SSHClient) -> None:
+    transport = client.get_transport()
+    if transport is not None:
+        transport.default_window_size = _SSH_WINDOW_SIZE
+        transport.set_keepalive(_SSH_KEEPALIVE_INTERVAL)
+
+
+def _ssh_client_active(client: paramiko.SSHClient) -> bool:
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+# is_active() only reflects what the transport noticed so far; an idle
+# transport to a host that has since rebooted still claims to be active.
+# Opening (and closing) a session needs an answer from the server, which
+# is still much cheaper than a new handshake.
+def _ssh_client_alive(client: paramiko.SSHClient) -> bool:
+    transport = client.get_transport()
+    if transport is None or not transport.is_active():
+        return False
+    try:
+        transport.open_session(timeout=_SSH_PROBE_TIMEOUT).close()
+    except Exception:
+        return False
+    return True
+
+
+# One SFTP session per SSH client, shared by all Hosts using that client.
+_sftp_clients: "weakref.WeakKeyDictionary[paramiko.SSHClient, paramiko.SFTPClient]" = weakref.WeakKeyDictionary()
+_sftp_clients_lock = threading.Lock()
+
+
+def _sftp_usable(sftp: Optional[paramiko.SFTPClient]) -> bool:
+    chan = sftp.get_channel() if sftp is not None else None
+    return chan is not None and not chan.closed
+
+
+def _reap_idle_clients() -> None:
+    global _ssh_reaper
+    while True:
+        time.sleep(_SSH_IDLE_TIMEOUT / 10)
+        now = time.monotonic()
+        expired = []
+        with _ssh_pool_lock:
+            for key, (client, users, idle_since) in list(_ssh_pool.items()):
+                if users == 0 and (now - idle_since > _SSH_IDLE_TIMEOUT or not _ssh_client_active(client)):
+                    del _ssh_pool[key]
+                    expired.append(client)
+            # Exit once there is nothing left to reap, logout() starts a
+            # new reaper when a client becomes idle again.
+            idle_left = any(users == 0 for _, users, _ in _ssh_pool.values())
+            if not idle_left:
+                _ssh_reaper = None
+        for client in expired:
+            client.close()
+        if not idle_left:
+            return
+
+
+def _start_reaper() -> None:
+    # Called with _ssh_pool_lock held.
+    global _ssh_reaper
+    if _ssh_reaper is None:
+        _ssh_reaper = threading.Thread(target=_reap_idle_clients, name="ssh-pool-reaper", daemon=True)
+        _ssh_reaper.start()
+
+
 class Login(ABC):
+    def __init__(self, hostname: str, username: str) -> None:
+        self._hostname = hostname
+        self._username = username
+
     @abstractmethod
-    def login(self) -> paramiko.SSHClient:
+    def _auth_id(self) -> str:
+        pass
+
+    @abstractmethod
+    def _connect(self) -> paramiko.SSHClient:
         pass
 
+    def pool_key(self) -> SSHPoolKey:
+        return (self._hostname, self._username, self._auth_id())
+
+    def login(self) -> paramiko.SSHClient:
+        key = self.pool_key()
+        pooled: Optional[paramiko.SSHClient] = None
+        with _ssh_pool_lock:
+            if key in _ssh_pool:
+                client, users, _ = _ssh_pool[key]
+                if _ssh_client_active(client):
+                    _ssh_pool[key] = (client, users + 1, 0.0)
+                    pooled = client
+                else:
+                    # Stale connection; other users will reconnect on their
+                    # next failure, and get the new client from the pool.
+                    del _ssh_pool[key]
+                    client.close()
+
+        # Probe outside the lock, it's a round-trip to the host.
+        if pooled is not None:
+            if _ssh_client_alive(pooled):
+                logger.debug(f"Reusing connection to {self._hostname} as {self._username}")
+                return pooled
+            self.evict(pooled)
+
+        client = self._connect()
+        _tune_transport(client)
+        with _ssh_pool_lock:
+            if key in _ssh_pool:
+                # Raced with another thread; keep theirs.
+                pooled, users, _ = _ssh_pool[key]
+                _ssh_pool[key] = (pooled, users + 1, 0.0)
+                client.close()
+                return pooled
+            _ssh_pool[key] = (client, 1, 0.0)
+        return client
+
+    def logout(self, client: paramiko.SSHClient) -> None:
+        key = self.pool_key()
+        with _ssh_pool_lock:
+            # The entry may have been replaced by a new client after an
+            # eviction, don't take a user away from that one.
+            if key not in _ssh_pool or _ssh_pool[key][0] is not client:
+                return
+            _, users, _ = _ssh_pool[key]
+            # Keep the client open for the next login, the reaper thread
+            # closes it if nobody picks it up within _SSH_IDLE_TIMEOUT.
+            _ssh_pool[key] = (client, max(users - 1, 0), time.monotonic())
+            if users <= 1:
+                _start_reaper()
+
+    def discard(self, client: paramiko.SSHClient) -> None:
+        # For a client that was logged in but isn't needed after all. Unlike
+        # logout(), close it right away unless someone else uses it.
+        key = self.pool_key()
+        with _ssh_pool_lock:
+            if key not in _ssh_pool or _ssh_pool[key][0] is not client:
+                return
+            _, users, idle_since = _ssh_pool[key]
+            if users > 1:
+                _ssh_pool[key] = (client, users - 1, idle_since)
+                return
+            del _ssh_pool[key]
+        client.close()
+
+    def evict(self, client: paramiko.SSHClient) -> None:
+        # For clients that failed in a way that is_active() doesn't notice.
+        # Other users of the client fail on their next command and then
+        # reconnect as well.
+        key = self.pool_key()
+        with _ssh_pool_lock:
+            if key not in _ssh_pool or _ssh_pool[key][0] is not client:
+                return
+            del _ssh_pool[key]
+        client.close()
+
+
+# Parsed private keys, keyed by (path, mtime, size) of the key file. A
+# KeyLogin is created for every host (and on every reconnect), but the key
+# files rarely change, so each is read and parsed once per process.
+_pkey_cache: Dict[Tuple[str, int, int], Union[RSAKey, Ed25519Key]] = {}
+
 
 class KeyLogin(Login):
     def __init__(self, hostname: str, username: str, key_path: str) -> None:
-        self._username = username
-        self._hostname = hostname
+        super().__init__(hostname, username)
         self._key_path = key_path
-        with open(key_path, "r") as f:
-            self._key = f.read().strip()
-
-        key_loader = self._key_loader()
-        self._pkey = key_loader.from_private_key(io.StringIO(self._key))
-
-    def _key_loader(self) -> Union[Type[Ed25519Key], Type[RSAKey]]:
-        if self._is_rsa():
-            return RSAKey
-        else:
-            return Ed25519Key
+        st = os.stat(key_path)
+        cache_key = (key_path, st.st_mtime_ns, st.st_size)
+        pkey = _pkey_cache.get(cache_key)
+        if pkey is None:
+            pkey = self._load_pkey()
+            _pkey_cache[cache_key] = pkey
+        self._pkey = pkey
+
+    def _load_pkey(self) -> Union[RSAKey, Ed25519Key]:
+        with open(self._key_path, "r") as f:
+            key = f.read().strip()
+        # Detect the key type by parsing it in-process, rather than by
+        # running "ssh-keygen -l": try RSA and fall back to Ed25519.
+        try:
+            return RSAKey.from_private_key(io.StringIO(key))
+        except ssh_exception.SSHException:
+            return Ed25519Key.from_private_key(io.StringIO(key))
 
     def _is_rsa(self) -> bool:
-        lh = LocalHost()
-        result = lh.run(f"ssh-keygen -vvv -l -f {self._key_path}")
-        logger.debug(result.out)
-        return "---[RSA " in result.out
+        return isinstance(self._pkey, RSAKey)
 
-    def login(self) -> paramiko.SSHClient:
+    def _auth_id(self) -> str:
+        return self._key_path
+
+    def _connect(self) -> paramiko.SSHClient:
         logger.info(f"Logging in into {self._hostname} with {self._key_path}")
         host = paramiko.SSHClient()
         host.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -82,11 +415,15 @@ class KeyLogin(Login):
 
 class PasswordLogin(Login):
     def __init__(self, hostname: str, username: str, password: str) -> None:
-        self._username = username
+        super().__init__(hostname, username)
         self._password = password
-        self._hostname = hostname
 
-    def login(self) -> paramiko.SSHClient:
+    def _auth_id(self) -> str:
+        # A client authenticated with one password must not be handed to a
+        # login with another one. Don't keep the password itself in the key.
+        return "password:" + hashlib.sha256(self._password.encode("utf-8")).hexdigest()
+
+    def _connect(self) -> paramiko.SSHClient:
         logger.info(f"Logging in into {self._hostname} with password")
         host = paramiko.SSHClient()
         host.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -210,22 +547,46 @@ def bmc_from_host_name_or_ip(hostname: str, ip: Optional[str], user: str = "root
 
 
 class Host:
+    _host: Optional[paramiko.SSHClient]
+    _logins: List[Login]
+    _login: Optional[Login]
+    _last_ping_ok: float
+
     def __new__(cls, hostname: str, bmc: Optional[BMC] = None) -> 'Host':
         key = (hostname, bmc.url if bmc else None)
-        if key not in host_instances:
-            host_instances[key] = super().__new__(cls)
+        # Keep a strong reference until returning, host_instances only holds
+        # weak ones.
+        instance = host_instances.get(key)
+        if instance is None:
+            instance = super().__new__(cls)
+            # The connection state lives here rather than in __init__, which
+            # runs again each time the shared instance is looked up and must
+            # not forget a live client.
+            instance._host = None
+            instance._logins = []
+            instance._login = None
+            instance._last_ping_ok = -math.inf
+            host_instances[key] = instance
             logger.debug(f"new instance for {hostname}")
-        return host_instances[key]
+        return instance
 
     def __init__(self, hostname: str, bmc: Optional[BMC] = None):
         self._hostname = hostname
         self._bmc = bmc
-        self._logins: List[Login] = []
+        self._is_localhost = hostname in ("localhost", socket.gethostname())
         self.sudo_needed = False
 
-    @lru_cache(maxsize=None)
+    def __del__(self) -> None:
+        login = getattr(self, "_login", None)
+        client = getattr(self, "_host", None)
+        if login is not None and client is not None:
+            try:
+                login.logout(client)
+            except Exception:
+                pass
+
     def is_localhost(self) -> bool:
-        return self._hostname in ("localhost", socket.gethostname())
+        return self._is_localhost
 
     def ssh_connect(self, username: str, password: Optional[str] = None, rsa_path: str = default_id_rsa_path(), ed25519_path: str = default_ed25519_path()) -> None:
         assert not self.is_localhost()
@@ -257,17 +618,69 @@ class Host:
     def ssh_connect_looped(self, logins: List[Login]) -> None:
         if len(logins) == 0:
             raise Exception("No usuable logins found")
+        delay = 1
         while True:
-            for e in logins:
+            client, login = self._try_logins(logins)
+            if client is not None and login is not None:
+                # Release the previous connection only after acquiring
+                # the new one, so a shared client isn't closed in between.
+                if self._login is not None and self._host is not None:
+                    self._login.logout(self._host)
+                self._host = client
+                self._login = login
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, 10)
+
+    def _try_logins(self, logins: List[Login]) -> Tuple[Optional[paramiko.SSHClient], Optional[Login]]:
+        # Try the logins in order, starting the next one as soon as the
+        # previous fails or takes longer than _SSH_LOGIN_STAGGER. Usually the
+        # first one succeeds and is the only handshake, but a key that is
+        # rejected or times out doesn't hold up the others.
+        executor = ThreadPoolExecutor(max_workers=len(logins))
+        not_started = list(logins)
+        running: Dict[Future[paramiko.SSHClient], Login] = {}
+        winner: Optional[Future[paramiko.SSHClient]] = None
+        winner_login: Optional[Login] = None
+        auth_error: Optional[ssh_exception.AuthenticationException] = None
+        while winner is None and (not_started or running):
+            if not_started:
+                login = not_started.pop(0)
+                running[executor.submit(login.login)] = login
+            timeout = _SSH_LOGIN_STAGGER if not_started else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            # Prefer the earlier login when several finished at once.
+            for f in sorted(done, key=lambda f: logins.index(running[f])):
+                login = running.pop(f)
                 try:
-                    self._host = e.login()
-                    return
+                    client = f.result()
                 except ssh_exception.AuthenticationException as e:
                     logger.info(type(e))
-                    raise e
+                    auth_error = e
+                    continue
                 except Exception as e:
                     logger.info(type(e))
-                    time.sleep(10)
+                    continue
+                if winner is None:
+                    winner = f
+                    winner_login = login
+                else:
+                    login.discard(client)
+
+        def discard_unused(f: Future[paramiko.SSHClient], login: Login) -> None:
+            if not f.cancelled() and f.exception() is None:
+                login.discard(f.result())
+
+        for f, login in running.items():
+            f.add_done_callback(functools.partial(discard_unused, login=login))
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        if winner is None:
+            # Rejected credentials won't start working by retrying.
+            if auth_error is not None:
+                raise auth_error
+            return None, None
+        return winner.result(), winner_login
 
     def _rsa_login(self) -> Optional[KeyLogin]:
         for x in self._logins:
@@ -280,10 +693,8 @@ class Host:
             if os.path.exists(source):
                 os.remove(source)
         else:
-            assert self._host is not None
             try:
-                sftp = self._host.open_sftp()
-                sftp.remove(source)
+                self._sftp_retry(lambda sftp: sftp.remove(source))
             except FileNotFoundError:
                 pass
 
@@ -294,77 +705,110 @@ class Host:
         if self.is_localhost():
             shutil.copy(src_file, dst_file)
         else:
-            while True:
-                try:
-                    sftp = self._host.open_sftp()
-                    sftp.put(src_file, dst_file)
-                    break
-                except Exception as e:
-                    logger.info(e)
-                    logger.info("Disconnected during sftpd, reconnecting...")
-                    self.ssh_connect_looped(self._logins)
+            self._sftp_retry(lambda sftp: sftp.put(src_file, dst_file))
+
+    def _sftp(self) -> paramiko.SFTPClient:
+        client = self._host
+        assert client is not None
+        with _sftp_clients_lock:
+            sftp = _sftp_clients.get(client)
+        if sftp is not None and _sftp_usable(sftp):
+            return sftp
+
+        # Opening the session is a network round-trip, don't hold the lock.
+        new_sftp = client.open_sftp()
+        with _sftp_clients_lock:
+            sftp = _sftp_clients.get(client)
+            if sftp is not None and _sftp_usable(sftp):
+                # Raced with another thread; keep theirs.
+                new_sftp.close()
+                return sftp
+            _sftp_clients[client] = new_sftp
+        return new_sftp
+
+    # Runs fn on the SFTP session, reconnecting and retrying when the
+    # connection was lost. Whether it was is decided from the connection
+    # state, not the exception: paramiko reports many server-side errors
+    # (EISDIR, ENOSPC, EROFS, ...) as a plain IOError without errno, and
+    # those must reach the caller instead of being retried.
+    def _sftp_retry(self, fn: Callable[[paramiko.SFTPClient], T]) -> T:
+        retries = 3
+        attempt = 0
+        while True:
+            sftp: Optional[paramiko.SFTPClient] = None
+            try:
+                sftp = self._sftp()
+                return fn(sftp)
+            except Exception as e:
+                connected = _sftp_usable(sftp) and self._host is not None and _ssh_client_active(self._host)
+                if connected or attempt == retries:
+                    raise
+                attempt += 1
+                logger.info(e)
+                logger.info("Disconnected during sftpd, reconnecting...")
+                self.ssh_connect_looped(self._logins)
 
     def need_sudo(self) -> None:
         self.sudo_needed = True
 
-    def run(self, cmd: str, log_level: int = logging.DEBUG, env: Dict[str, str] = os.environ.copy()) -> Result:
-        if self.sudo_needed:
-            cmd = "sudo " + cmd
+    # cmd is either a command line, or an argv list. An argv list is executed
+    # as is on localhost, without splitting a joined string again, and is
+    # quoted for the remote shell otherwise.
+    def run(self, cmd: Union[str, List[str]], log_level: int = logging.DEBUG, env: Optional[Dict[str, str]] = None, combine_stderr: bool = False) -> Result:
+        argv: Optional[List[str]] = None
+        if isinstance(cmd, list):
+            argv = ["sudo", *cmd] if self.sudo_needed else cmd
+            cmd_line = shlex.join(argv)
+        else:
+            cmd_line = "sudo " + cmd if self.sudo_needed else cmd
 
-        logger.log(log_level, f"running command {cmd} on {self._hostname}")
+        if logger.isEnabledFor(log_level):
+            logger.log(log_level, f"running command {cmd_line} on {self._hostname}")
         if self.is_localhost():
-            ret_val = self._run_local(cmd, env)
+            ret_val = self._run_local(argv if argv is not None else shlex.split(cmd_line), env, combine_stderr)
+        elif argv is not None:
+            ret_val = self._run_remote(cmd_line, log_level, combine_stderr)
         else:
-            ret_val = self._run_remote(cmd, log_level)
+            # Make sure multiline command is not seen as multiple commands
+            ret_val = self._run_remote(cmd_line.replace("\n", "\\\n"), log_level, combine_stderr)
 
         logger.log(log_level, ret_val)
         return ret_val
 
-    def _run_local(self, cmd: str, env: Dict[str, str]) -> Result:
-        args = shlex.split(cmd)
-        pipe = subprocess.PIPE
-        with subprocess.Popen(args, stdout=pipe, stderr=pipe, env=env) as proc:
-            if proc.stdout is None:
-                logger.info("Can't find stdout")
-                sys.exit(-1)
-            if proc.stderr is None:
-                logger.info("Can't find stderr")
-                sys.exit(-1)
-            out = proc.stdout.read().decode("utf-8")
-            err = proc.stderr.read().decode("utf-8")
-            proc.communicate()
-            ret = proc.returncode
-        return Result(out, err, ret)
-
-    def _run_remote(self, cmd: str, log_level: int) -> Result:
-        def read_output(cmd: str, log_level: int) -> Result:
-            assert self._host is not None
-            _, stdout, stderr = self._host.exec_command(cmd)
-
-            out = []
-            for line in iter(stdout.readline, ""):
-                logger.log(log_level, f"{self._hostname}: {line.strip()}")
-                out.append(line)
-
-            err = []
-            for line in iter(stderr.readline, ""):
-                err.append(line)
-
-            exit_code = stdout.channel.recv_exit_status()
-
-            return Result("".join(out), "".join(err), exit_code)
-
-        # Make sure multiline command is not seen as multiple commands
-        cmd = cmd.replace("\n", "\\\n")
+    def _run_local(self, args: List[str], env: Optional[Dict[str, str]], combine_stderr: bool = False) -> Result:
+        # env=None lets the child inherit os.environ without copying it.
+        # subprocess already spawns via vfork() on Linux, so the cost of a
+        # short command is dominated by exec; communicate() reads stdout and
+        # stderr concurrently, so neither can block the child on a full pipe.
+        stderr = subprocess.STDOUT if combine_stderr else subprocess.PIPE
+        proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=stderr, env=env)
+        err = proc.stderr.decode("utf-8") if proc.stderr is not None else ""
+        return Result(proc.stdout.decode("utf-8"), err, proc.returncode)
+
+    def _run_remote(self, cmd: str, log_level: int, combine_stderr: bool = False) -> Result:
         while True:
             try:
-                return read_output(cmd, log_level)
+                assert self._host is not None
+                return ssh_run_poll_result(self._host, cmd, self._hostname, log_level, combine_stderr)
             except Exception as e:
                 logger.log(log_level, e)
                 logger.log(log_level, f"Connection lost while running command {cmd}, reconnecting...")
+                if isinstance(e, ssh_exception.SSHException) and self._login is not None and self._host is not None:
+                    # Don't get the same broken client back from the pool.
+                    self._login.evict(self._host)
                 self.ssh_connect_looped(self._logins)
 
-    def run_or_die(self, cmd: str) -> Result:
+    @contextmanager
+    def persistent_shell(self) -> Iterator[PersistentShell]:
+        assert not self.is_localhost()
+        assert self._host is not None
+        shell = PersistentShell(self._host, self._hostname, self.sudo_needed)
+        try:
+            yield shell
+        finally:
+            shell.close()
+
+    def run_or_die(self, cmd: Union[str, List[str]]) -> Result:
         ret = self.run(cmd)
         if ret.returncode:
             logger.error(f"{cmd} failed: {ret.err}")
@@ -374,8 +818,14 @@ class Host:
         return ret
 
     def close(self) -> None:
-        assert self._host is not None
-        self._host.close()
+        if self._host is None or self._login is None:
+            return
+        # The client may be shared with other Hosts, and stays pooled for a
+        # while after its last user is gone.
+        self._login.logout(self._host)
+        self._login = None
+        # Don't keep using a client the pool no longer counts us in for.
+        self._host = None
 
     def boot_iso_redfish(self, iso_path: str) -> None:
         if self._bmc is None:
@@ -397,26 +847,33 @@ class Host:
             raise Exception(f"Can't cold boot host without bmc on {self.hostname()}")
         self._bmc.cold_boot()
 
-    def wait_ping(self) -> None:
+    def wait_ping(self, timeout: Optional[float] = None) -> None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.1
         while not self.ping():
-            pass
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"{self._hostname} did not respond within {timeout}s")
+            # A refused connection fails immediately; don't spin on it.
+            time.sleep(delay)
+            delay = min(delay * 1.5, 1.0)
 
     def ping(self) -> bool:
-        lh = Host("localhost")
-        ping_cmd = f"timeout 1 ping -4 -c 1 {self._hostname}"
-        r = lh.run(ping_cmd)
-        return r.returncode == 0
+        # ssh_connect() is often called right after a successful probe (by
+        # the caller or an earlier ssh_connect), don't repeat it.
+        if time.monotonic() - self._last_ping_ok < 5:
+            return True
+        # Probe the SSH port, which is what callers are about to use, instead
+        # of forking "ping" for every probe.
+        try:
+            with socket.create_connection((self._hostname, 22), timeout=1):
+                self._last_ping_ok = time.monotonic()
+                return True
+        except OSError:
+            return False
 
     def os_release(self) -> Dict[str, str]:
-        d = {}
-        for e in self.read_file("/etc/os-release").split("\n"):
-            split_e = e.split("=", maxsplit=1)
-            if len(split_e) != 2:
-                continue
-            k, v = split_e
-            v = v.strip("\"'")
-            d[k] = v
-        return d
+        matches = _OS_RELEASE_RE.findall(self.read_file("/etc/os-release"))
+        return {k: v.strip("\"'") for k, v in matches}
 
     def running_fcos(self) -> bool:
         d = self.os_release()
@@ -424,9 +881,9 @@ class Host:
 
     def vm_is_running(self, name: str) -> bool:
         def state_running(out: str) -> bool:
-            return re.search("State:.*running", out) is not None
+            return _VIRSH_RUNNING_RE.search(out) is not None
 
-        ret = self.run(f"virsh dominfo {name}", logging.DEBUG)
+        ret = self.run(f"virsh dominfo {name}", logging.DEBUG, combine_stderr=True)
         return not ret.returncode and state_running(ret.out)
 
     def ipa(self) -> Any:
@@ -439,7 +896,7 @@ class Host:
         return json.loads(self.run("ip -json link", logging.DEBUG).out)
 
     def port_exists(self, port_name: str) -> bool:
-        return self.run(f"ip link show {port_name}").returncode == 0
+        return self.run(f"ip link show {port_name}", combine_stderr=True).returncode == 0
 
     def port_has_carrier(self, port_name: str) -> bool:
         ports = {x["ifname"]: x for x in self.ipa()}
@@ -448,40 +905,64 @@ class Host:
         return "NO-CARRIER" not in ports[port_name]["flags"]
 
     def write(self, fn: str, contents: str) -> None:
+        b_contents = contents.encode('utf-8')
         if self.is_localhost():
-            with open(fn, "w") as f:
-                f.write(contents)
+            with open(fn, "wb") as f:
+                f.write(b_contents)
         else:
-            with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-                tmp_filename = tmp_file.name
-                tmp_file.write(contents.encode('utf-8'))
-            self.copy_to(tmp_filename, fn)
-            os.remove(tmp_filename)
+            # Stream straight from memory over SFTP, rather than through a
+            # local temporary file and copy_to().
+            def write(sftp: paramiko.SFTPClient) -> None:
+                with sftp.open(fn, "wb") as f:
+                    f.write(b_contents)
+
+            self._sftp_retry(write)
 
     def read_file(self, file_name: str) -> str:
         if self.is_localhost():
             with open(file_name) as f:
                 return f.read()
-        else:
+        elif self.sudo_needed:
             ret = self.run(f"cat {file_name}")
             if ret.returncode == 0:
                 return ret.out
             raise Exception(f"Error reading {file_name}")
 
+        # Read over SFTP instead of running "cat": no shell on the remote
+        # side, and prefetch() pipelines the reads.
+        def read(sftp: paramiko.SFTPClient) -> bytes:
+            with sftp.open(file_name, "rb") as f:
+                f.prefetch()
+                return f.read()
+
+        try:
+            return self._sftp_retry(read).decode("utf-8")
+        except OSError as e:
+            raise Exception(f"Error reading {file_name}") from e
+
     def listdir(self, path: Optional[str] = None) -> List[str]:
         if self.is_localhost():
             return os.listdir(path)
         path = path if path is not None else ""
-        ret = self.run(f"ls {path}")
-        if ret.returncode == 0:
-            return ret.out.strip().split("\n")
-        raise Exception(f"Error listing dir {path}")
+        if self.sudo_needed:
+            ret = self.run(f"ls {path}")
+            if ret.returncode == 0:
+                return ret.out.strip().split("\n")
+            raise Exception(f"Error listing dir {path}")
+
+        # SFTP returns the names as a list (like os.listdir()), there is no
+        # shell to spawn and no parsing of "ls" output that breaks on
+        # whitespace in file names.
+        try:
+            return self._sftp_retry(lambda sftp: sftp.listdir(path or "."))
+        except OSError as e:
+            raise Exception(f"Error listing dir {path}") from e
 
     def hostname(self) -> str:
         return self._hostname
 
     def exists(self, path: str) -> bool:
-        return self.run(f"stat {path}", logging.DEBUG).returncode == 0
+        return self.run(f"stat {path}", logging.DEBUG, combine_stderr=True).returncode == 0
 
 
 class HostWithCX(Host):
@@ -491,7 +972,7 @@ class HostWithCX(Host):
 
     def run_in_container(self, cmd: str, interactive: bool = False) -> Result:
         name = "cx"
-        setup = f"sudo podman run --pull always --replace --pid host --network host --user 0 --name {name} -dit --privileged -v /dev:/dev quay.io/bnemeth/bf"
+        setup = ["sudo", "podman", "run", "--pull", "newer", "--replace", "--pid", "host", "--network", "host", "--user", "0", "--name", name, "-dit", "--privileged", "-v", "/dev:/dev", "quay.io/bnemeth/bf"]
         r = self.run(setup, logging.DEBUG)
         if r.returncode != 0:
             return r
@@ -503,6 +984,7 @@ class HostWithBF2(Host):
     def connect_to_bf(self, bf_addr: str) -> None:
         self.ssh_connect("core")
         prov_host = self._host
+        assert prov_host is not None
         rsa_login = self._rsa_login()
         if rsa_login is None:
             logger.error("Missing login with key")
@@ -523,30 +1005,21 @@ class HostWithBF2(Host):
         self._bf_host = paramiko.SSHClient()
         self._bf_host.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         self._bf_host.connect(bf_addr, username='core', pkey=pkey, sock=chan)
+        _tune_transport(self._bf_host)
 
     def run_on_bf(self, cmd: str, log_level: int = logging.DEBUG) -> Result:
-        _, stdout, stderr = self._bf_host.exec_command(cmd)
-
-        out = []
-        for line in iter(stdout.readline, ""):
-            logger.log(log_level, f"{self._hostname} -> BF: {line.strip()}")
-            out.append(line)
-
-        err: List[str] = []
-        for line in iter(stderr.readline, ""):
-            err.append(line)
-
-        exit_code = stdout.channel.recv_exit_status()
-        return Result("".join(out), "".join(err), exit_code)
+        return ssh_run_poll_result(self._bf_host, cmd, f"{self._hostname} -> BF", log_level)
 
     def run_in_container(self, cmd: str, interactive: bool = False) -> Result:
         name = "bf"
-        setup = f"sudo podman run --pull always --replace --pid host --network host --user 0 --name {name} -dit --privileged -v /dev:/dev quay.io/bnemeth/bf"
-        r = self.run(setup, logging.DEBUG)
-        if r.returncode != 0:
-            return r
+        setup = ["sudo", "podman", "run", "--pull", "newer", "--replace", "--pid", "host", "--network", "host", "--user", "0", "--name", name, "-dit", "--privileged", "-v", "/dev:/dev", "quay.io/bnemeth/bf"]
         it = "-it" if interactive else ""
-        return self.run(f"sudo podman exec {it} {name} {cmd}")
+        # Set up the container and exec in it over a single channel.
+        with self.persistent_shell() as shell:
+            r = shell.run(shlex.join(setup), logging.DEBUG)
+            if r.returncode != 0:
+                return r
+            return shell.run(f"sudo podman exec {it} {name} {cmd}")
 
     def bf_pxeboot(self, nfs_iso: str, nfs_key: str) -> Result:
         cmd = "sudo killall python3"
@@ -579,7 +1052,9 @@ class HostWithBF2(Host):
         return self.run_in_container("/bfb")
 
 
-host_instances: Dict[Tuple[str, Optional[str]], Host] = {}
+# Hosts are shared per hostname/BMC while in use, but not kept alive (with
+# their SSH connection) once nothing references them anymore.
+host_instances: weakref.WeakValueDictionary[Tuple[str, Optional[str]], Host] = weakref.WeakValueDictionary()
 
 
 def sync_time(src: Host, dst: Host) -> Result:
@@ -587,6 +1062,10 @@ def sync_time(src: Host, dst: Host) -> Result:
     return dst.run(f"sudo date -s \"{date}\"")
 
 
+# Host.run() on localhost only spawns a subprocess per call, so sharing one
+# instance between callers (and threads) is safe. Host("localhost") alone
+# would return the same object while it's alive, but re-run __init__ on it.
+@functools.cache
 def LocalHost() -> Host:
     return Host("localhost")
 
@@ -67,7 +67,7 @@ def generate_kickstart(rhel_number: str, uname_m: str) -> None:
     with open('pull_secret.json', 'r') as f_in:
         file_contents = f_in.read()
 
-    ssh_pub, _, _ = next(common.iterate_ssh_keys(), (None, None, None))
+    ssh_pub, _, _ = next(iter(common.iterate_ssh_keys()), (None, None, None))
     if ssh_pub is not None:
         with open(ssh_pub, 'r') as ssh_in:
             ssh_contents = ssh_in.read()
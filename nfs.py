@@ -20,23 +20,24 @@ class NFS:
 
     def host_file(self, file: str) -> str:
         dir_name = os.path.dirname(file)
-        if not self._exists(dir_name):
-            self._add(dir_name)
+        # Read /etc/exports and look up the address once, each of them is a
+        # command (or SFTP round-trip) on the NFS host.
+        exports = self._host.read_file("/etc/exports")
+        if not self._exists(exports, dir_name):
+            self._add(exports, dir_name)
         self._export_fs()
         ip = self._ip()
         if ip is None:
             logger.error(f"Failed to get ip when hosting file {file} on nfs")
             sys.exit(-1)
-        ret = f"{self._ip()}:{file}"
+        ret = f"{ip}:{file}"
         return ret
 
-    def _exists(self, dir_name: str) -> bool:
-        exports = self._host.read_file("/etc/exports")
+    def _exists(self, exports: str, dir_name: str) -> bool:
         return any(dir_name in x.split(" ")[0] for x in exports.split("\n"))
 
-    def _add(self, dir_name: str) -> None:
-        contents = self._host.read_file("/etc/exports")
-        self._host.write("/etc/exports", f"{contents}\n{dir_name}")
+    def _add(self, exports: str, dir_name: str) -> None:
+        self._host.write("/etc/exports", f"{exports}\n{dir_name}")
 
     def _export_fs(self) -> None:
         self._host.run("systemctl enable nfs-server")